@@ -10,6 +10,7 @@ import movear.models.dist as dist
 from movear.models.moevar import MoEVAR
 from movear.models.vqvae import VQVAE, VectorQuantizer2
 from movear.utils.amp_sc import AmpOptimizer
+from movear.utils.data import normalize_uint8_into_pm1
 from movear.utils.misc import MetricLogger, TensorboardLogger
 
 Ten = torch.Tensor
@@ -74,7 +75,7 @@ class HLMoEVARTrainer(object):
         
         for i, (inp_B3HW, label_B) in enumerate(ld_val):
             B, V = label_B.shape[0], self.vae_local.vocab_size
-            inp_B3HW = inp_B3HW.to(dist.get_device(), non_blocking=True)
+            inp_B3HW = normalize_uint8_into_pm1(inp_B3HW.to(dist.get_device(), non_blocking=True).contiguous(memory_format=torch.channels_last))
             label_B = label_B.to(dist.get_device(), non_blocking=True)
             
             # 处理当前批次
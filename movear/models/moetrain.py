@@ -12,11 +12,11 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 
 import movear.models.dist as dist
 from movear.utils import arg_util, misc
-from movear.utils.data import build_dataset
+from movear.utils.data import build_dataset, normalize_uint8_into_pm1, pin_memory_collate
 from movear.utils.data_sampler import DistInfiniteBatchSampler, EvalDistributedSampler
 from movear.utils.misc import auto_resume
-from movear.utils.amp_sc import AmpOptimizer
-from movear.utils.lr_control import filter_params, lr_wd_annealing
+from movear.utils.amp_sc import AmpOptimizer, pick_adamw_impl
+from movear.utils.lr_control import filter_params, lr_wd_annealing_table, set_lr_wd
 from movear.models.vqvae import VQVAE
 from movear.models.moevar import MoEVAR
 from movear.models.moebuild import build_vae_moe_var, load_pretrained_for_moe
@@ -55,21 +55,30 @@ def build_everything(args: arg_util.Args):
             args.data_path, final_reso=args.data_load_reso, hflip=args.hflip, mid_reso=args.mid_reso,
         )
         types = str((type(dataset_train).__name__, type(dataset_val).__name__))
+
+        eff_workers = max(8, args.workers)  # 增加至少8个工作线程
+        if args.auto_workers:   # cap to cores-per-rank: more workers than that just thrash context switches
+            eff_workers = min(eff_workers, max(2, (os.cpu_count() or 8) // max(1, dist.get_world_size())))
+        val_workers = max(1, eff_workers // 2) if args.auto_workers else 0
+        print(f'[dataloader] auto_workers={args.auto_workers}, num_workers: train={eff_workers}, val={val_workers}')
+
         val_batch_size = max(4, round(args.batch_size // 4))
         ld_val = DataLoader(
-            dataset_val, num_workers=0, pin_memory=True,
-            batch_size=val_batch_size, 
+            dataset_val, num_workers=val_workers, pin_memory=False, collate_fn=pin_memory_collate,
+            persistent_workers=val_workers > 0, prefetch_factor=args.prefetch_factor if val_workers > 0 else None,
+            batch_size=val_batch_size,
             sampler=EvalDistributedSampler(dataset_val, num_replicas=dist.get_world_size(), rank=dist.get_rank()),
             shuffle=False, drop_last=False,
         )
         del dataset_val
         
         ld_train = DataLoader(
-            dataset=dataset_train, 
-            num_workers=8,  # 增加至少8个工作线程
-            pin_memory=True,
+            dataset=dataset_train,
+            num_workers=eff_workers,
+            pin_memory=False,  # pinned worker-side by pin_memory_collate
+            collate_fn=pin_memory_collate,
             persistent_workers=True,  # 保持worker进程活跃
-            prefetch_factor=2,  # 预加载批次数
+            prefetch_factor=args.prefetch_factor,  # 预加载批次数
             generator=args.get_different_generator_for_each_rank(),
             batch_sampler=DistInfiniteBatchSampler(
                 dataset_len=len(dataset_train), glb_batch_size=args.glb_batch_size, 
@@ -83,9 +92,9 @@ def build_everything(args: arg_util.Args):
         [print(line) for line in auto_resume_info]
         print(f'[dataloader multi processing] ...', end='', flush=True)
         stt = time.time()
-        iters_train = len(ld_train)
-        ld_train = iter(ld_train)
-        print(f'     [dataloader multi processing](*) finished! ({time.time()-stt:.2f}s)', flush=True)
+        iters_train = len(ld_train)     # length comes from the batch_sampler; doesn't start workers
+        ld_train = misc.LazyDataLoaderIter(ld_train)    # worker spawn overlaps model build / VAE download
+        print(f'     [dataloader multi processing](*) backgrounded! ({time.time()-stt:.2f}s)', flush=True)
         print(f'[dataloader] gbs={args.glb_batch_size}, lbs={args.batch_size}, iters_train={iters_train}, types(tr, va)={types}')
     else:
         num_classes = 1000
@@ -107,9 +116,23 @@ def build_everything(args: arg_util.Args):
     vae_ckpt = 'vae_ch160v4096z32.pth'
     if dist.is_local_master():
         if not os.path.exists(vae_ckpt):
-            os.system(f'wget https://huggingface.co/FoundationVision/var/resolve/main/{vae_ckpt}')
+            from huggingface_hub import hf_hub_download
+            # streams in-process with retry + resume; no wget subprocess to fork, and a killed
+            # download doesn't leave a partial file where the exists() check would trust it
+            hf_hub_download(repo_id='FoundationVision/var', filename=vae_ckpt, local_dir=os.path.dirname(os.path.abspath(vae_ckpt)))
     dist.barrier()
-    vae_local.load_state_dict(torch.load(vae_ckpt, map_location='cpu'), strict=True)
+    # mmap: tensors stay page-cache-backed instead of being read into Python-owned memory;
+    # weights_only skips pickle object deserialization. load_state_dict then copies each
+    # tensor straight from the mapping into the (GPU-resident) params, one copy total
+    if dist.is_master() or not dist.initialized():
+        vae_local.load_state_dict(torch.load(vae_ckpt, map_location='cpu', mmap=True, weights_only=True), strict=True)
+    if dist.initialized():
+        # one disk read + NCCL broadcast instead of world_size reads hammering the shared fs;
+        # the state_dict tensors alias the live (GPU) params, so broadcasting in place suffices
+        for t in vae_local.state_dict().values():
+            dist.broadcast(t, src_rank=0)
+    vae_local = vae_local.to(memory_format=torch.channels_last)  # NHWC conv kernels on tensor cores; no accuracy change
+
     
     # Load pretrained VAR weights if specified
     if args.pretrained_var:
@@ -121,20 +144,15 @@ def build_everything(args: arg_util.Args):
     var_wo_ddp: MoEVAR = args.compile_model(var_wo_ddp, args.tfast)
     
     # Create DDP model for distributed training
-    class NullDDP(torch.nn.Module):
-        def __init__(self, module, *args, **kwargs):
-            super(NullDDP, self).__init__()
-            self.module = module
-            self.require_backward_grad_sync = False
-        
-        def forward(self, *args, **kwargs):
-            return self.module(*args, **kwargs)
-    
-    var: DDP = (DDP if dist.initialized() else NullDDP)(
-        var_wo_ddp, device_ids=[dist.get_local_rank()], 
-        find_unused_parameters=True,  # 将False改为True
-        broadcast_buffers=False
-    )
+    if dist.initialized():
+        var: DDP = DDP(
+            var_wo_ddp, device_ids=[dist.get_local_rank()], 
+            find_unused_parameters=True,  # 将False改为True
+            broadcast_buffers=False
+        )
+    else:
+        var = var_wo_ddp    # single-GPU: a DDP-shaped wrapper would only add a Python frame per forward
+        var.require_backward_grad_sync = True   # plain attribute here; train_step toggles it freely
     
     # Print model information
     print(f'[INIT] MoEVAR model = {var_wo_ddp}\n\n')
@@ -155,9 +173,13 @@ def build_everything(args: arg_util.Args):
         'ada_gss', 'moe_bias',
         'scale_mul',
     })
+    for p in paras:
+        p.data = p.data.contiguous()    # fused/foreach multi-tensor kernels silently skip non-contiguous params
+    adamw_kw = pick_adamw_impl(paras, args.fp16) if args.afuse else {}
+    print(f'[INIT] AdamW impl kwargs = {adamw_kw}')
     opt_clz = {
-        'adam':  partial(torch.optim.AdamW, betas=(0.9, 0.95), fused=args.afuse),
-        'adamw': partial(torch.optim.AdamW, betas=(0.9, 0.95), fused=args.afuse),
+        'adam':  partial(torch.optim.AdamW, betas=(0.9, 0.95), **adamw_kw),
+        'adamw': partial(torch.optim.AdamW, betas=(0.9, 0.95), **adamw_kw),
     }[args.opt.lower().strip()]
     opt_kw = dict(lr=args.tlr, weight_decay=0)
     print(f'[INIT] optim={opt_clz}, opt_kw={opt_kw}\n')
@@ -165,7 +187,7 @@ def build_everything(args: arg_util.Args):
     var_optim = AmpOptimizer(
         mixed_precision=args.fp16, optimizer=opt_clz(params=para_groups, **opt_kw), 
         names=names, paras=paras,
-        grad_clip=args.tclip, n_gradient_accumulation=args.ac
+        grad_clip=args.tclip, n_gradient_accumulation=args.ac, fuse_accumulation=args.afuse_accu,
     )
     del names, paras, para_groups
     
@@ -234,17 +256,25 @@ def train_one_ep(ep: int, is_first_ep: bool, start_it: int, args: arg_util.Args,
         warnings.filterwarnings('ignore', category=UserWarning)
     
     g_it, max_it = ep * iters_train, args.ep * iters_train
-    
-    # 创建主进程的进度条
-    pbar = None
+    wp_it = args.wp * iters_train
+    # the whole lr/wd schedule is precomputed once per epoch; per-iter cost is one array index
+    lr_sched, wd_sched = lr_wd_annealing_table(args.sche, args.tlr, args.twd, args.twde, wp_it, max_it, wp0=args.wp0, wpe=args.wpe)
+    # dedicated H2D copy stream: the CPU runs ahead of the GPU, so issuing the pinned-memory
+    # copy of batch N on its own stream lets it overlap the tail of batch N-1's compute
+    copy_stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+    
+    # 创建主进程的进度条; 其他rank用NullBar占位, 不渲染
     if dist.is_master():
         pbar = tqdm(
             total=iters_train-start_it, 
             desc=f"Epoch {ep}/{args.ep}", 
             position=0, 
             leave=True,
-            ncols=100
+            ncols=100,
+            mininterval=0.5, maxinterval=2.0,   # throttle redraws
         )
+    else:
+        pbar = misc.NullBar()
     
     # 修改训练循环以更新进度条
     for it, (inp, label) in me.log_every(start_it, iters_train, ld_or_itrt, 30 if iters_train > 8000 else 5, header):
@@ -252,17 +282,22 @@ def train_one_ep(ep: int, is_first_ep: bool, start_it: int, args: arg_util.Args,
         if it < start_it: continue
         if is_first_ep and it == start_it: warnings.resetwarnings()
         
-        inp = inp.to(args.device, non_blocking=True)
-        label = label.to(args.device, non_blocking=True)
+        if copy_stream is not None:
+            with torch.cuda.stream(copy_stream):
+                inp = inp.to(args.device, non_blocking=True)
+                label = label.to(args.device, non_blocking=True)
+            torch.cuda.current_stream().wait_stream(copy_stream)
+            inp.record_stream(torch.cuda.current_stream())
+            label.record_stream(torch.cuda.current_stream())
+        else:
+            inp = inp.to(args.device, non_blocking=True)
+            label = label.to(args.device, non_blocking=True)
+        inp = normalize_uint8_into_pm1(inp.contiguous(memory_format=torch.channels_last))  # dataloader ships uint8; cast + scale on the GPU, NHWC to match the VAE
         
         args.cur_it = f'{it+1}/{iters_train}'
         
-        # Learning rate and weight decay scheduling
-        wp_it = args.wp * iters_train
-        min_tlr, max_tlr, min_twd, max_twd = lr_wd_annealing(
-            args.sche, trainer.var_opt.optimizer, args.tlr, args.twd, args.twde, 
-            g_it, wp_it, max_it, wp0=args.wp0, wpe=args.wpe
-        )
+        # Learning rate and weight decay scheduling (precomputed table, see above)
+        min_tlr, max_tlr, min_twd, max_twd = set_lr_wd(trainer.var_opt.optimizer, lr_sched[g_it], wd_sched[g_it])
         args.cur_lr, args.cur_wd = max_tlr, max_twd
         
         # Progressive training setup
@@ -287,44 +322,41 @@ def train_one_ep(ep: int, is_first_ep: bool, start_it: int, args: arg_util.Args,
             inp_B3HW=inp, label_B=label, prog_si=prog_si, prog_wp_it=args.pgwp * iters_train,
         )
         
-        # Update learning rate and other metrics in tensorboard
+        # Update learning rate and other metrics in tensorboard (one batched write per iter)
         me.update(tlr=max_tlr)
         tb_lg.set_step(step=g_it)
-        tb_lg.update(head='AR_opt_lr/lr_min', sche_tlr=min_tlr)
-        tb_lg.update(head='AR_opt_lr/lr_max', sche_tlr=max_tlr)
-        tb_lg.update(head='AR_opt_wd/wd_max', sche_twd=max_twd)
-        tb_lg.update(head='AR_opt_wd/wd_min', sche_twd=min_twd)
-        tb_lg.update(head='AR_opt_grad/fp16', scale_log2=scale_log2)
-        
-        # Log gradient norm if clipping is enabled
+        opt_scalars = {
+            'AR_opt_lr/lr_min/sche_tlr': min_tlr,
+            'AR_opt_lr/lr_max/sche_tlr': max_tlr,
+            'AR_opt_wd/wd_max/sche_twd': max_twd,
+            'AR_opt_wd/wd_min/sche_twd': min_twd,
+            'AR_opt_grad/fp16/scale_log2': scale_log2,
+        }
         if args.tclip > 0:
-            tb_lg.update(head='AR_opt_grad/grad', grad_norm=grad_norm)
-            tb_lg.update(head='AR_opt_grad/grad', grad_clip=args.tclip)
-        
-        # MoE-specific logging
+            opt_scalars['AR_opt_grad/grad/grad_norm'] = grad_norm
+            opt_scalars['AR_opt_grad/grad/grad_clip'] = args.tclip
         if 'MoELoss' in me.meters:
-            moe_loss = me.meters['MoELoss'].global_avg
-            tb_lg.update(head='MoE/aux_loss', aux_loss=moe_loss, step=g_it)
-            tb_lg.update(head='MoE/aux_weight', aux_weight=args.aux_weight, step=g_it)
+            opt_scalars['MoE/aux_loss/aux_loss'] = me.meters['MoELoss'].global_avg
+            opt_scalars['MoE/aux_weight/aux_weight'] = args.aux_weight
+        tb_lg.update_many(opt_scalars)
         
         # 更新进度条
-        if dist.is_master() and pbar is not None:
-            pbar.update(1)
-            # 显示关键指标
-            moe_loss = me.meters.get('MoELoss', misc.SmoothedValue()).median if 'MoELoss' in me.meters else 0.0
-            pbar.set_postfix({
-                'loss': f"{me.meters['Lm'].median:.4f}",
-                'acc': f"{me.meters['Accm'].median:.1f}%",
-                'lr': f"{max_tlr:.6f}",
-                'MoE': f"{moe_loss:.5f}"
-            })
+        pbar.update(1)
+        # 显示关键指标; medians re-sort the window, so only refresh them at the log cadence
+        if it in me.log_iters:
+            moe_loss = me.meters['MoELoss'].median if 'MoELoss' in me.meters else 0.0
+            pbar.set_postfix_str(
+                f"loss={me.meters['Lm'].median:.4f}, acc={me.meters['Accm'].median:.1f}%, "
+                f"lr={max_tlr:.6f}, MoE={moe_loss:.5f}"
+            )
     
     # 关闭进度条
-    if dist.is_master() and pbar is not None:
-        pbar.close()
+    pbar.close()
     
     me.synchronize_between_processes()
-    return {k: meter.global_avg for k, meter in me.meters.items()}, me.iter_time.time_preds(max_it - (g_it + 1) + (args.ep - ep) * 15)
+    # only the master's ETA is ever printed; skip the strftime/timedelta work elsewhere
+    time_pred = me.iter_time.time_preds(max_it - (g_it + 1) + (args.ep - ep) * 15) if dist.is_master() else (0., '-', '-')
+    return {k: meter.global_avg for k, meter in me.meters.items()}, time_pred
 
 
 def main_training():
@@ -417,24 +449,15 @@ def main_training():
                 
                 print(f'[saving ckpt] ...', end='', flush=True)
                 try:
-                    tmp_ckpt = local_out_ckpt + '.tmp'
-                    torch.save({
+                    misc.save_ckpt_async({
                         'epoch': ep+1,
                         'iter': 0,
                         'trainer': trainer.state_dict(),
                         'args': args.state_dict(),
-                    }, tmp_ckpt)
-                    if os.path.exists(local_out_ckpt):
-                        os.rename(local_out_ckpt, local_out_ckpt + '.bak')
-                    os.rename(tmp_ckpt, local_out_ckpt)
-                    print(f"     [saving ckpt](*) finished! @ {local_out_ckpt}", flush=True)
+                    }, local_out_ckpt, best_dst=local_out_ckpt_best if best_updated else None)
+                    print(f"     [saving ckpt](*) serialized to shm; disk write continues in background @ {local_out_ckpt}", flush=True)
                 except Exception as e:
                     print(f"     [saving ckpt] ERROR: {str(e)}", flush=True)
-                
-                if best_updated:
-                    shutil.copy(local_out_ckpt, local_out_ckpt_best)
-                
-                print(f'     [saving ckpt](*) finished!  @ {local_out_ckpt}', flush=True)
             
             dist.barrier()
         
@@ -11,7 +11,7 @@ from torch.utils.data import DataLoader
 
 import dist
 from utils import arg_util, misc
-from utils.data import build_dataset
+from utils.data import build_dataset, normalize_uint8_into_pm1, pin_memory_collate
 from utils.data_sampler import DistInfiniteBatchSampler, EvalDistributedSampler
 from utils.misc import auto_resume
 
@@ -43,16 +43,25 @@ def build_everything(args: arg_util.Args):
             args.data_path, final_reso=args.data_load_reso, hflip=args.hflip, mid_reso=args.mid_reso,
         )
         types = str((type(dataset_train).__name__, type(dataset_val).__name__))
-        
+
+        eff_workers = args.workers
+        if args.auto_workers:   # cap to cores-per-rank: more workers than that just thrash context switches
+            eff_workers = min(eff_workers, max(2, (os.cpu_count() or 8) // max(1, dist.get_world_size())))
+        val_workers = max(1, eff_workers // 2) if args.auto_workers else 0
+        print(f'[dataloader] auto_workers={args.auto_workers}, num_workers: train={eff_workers}, val={val_workers}')
+
         ld_val = DataLoader(
-            dataset_val, num_workers=0, pin_memory=True,
+            dataset_val, num_workers=val_workers, pin_memory=False, collate_fn=pin_memory_collate,
+            persistent_workers=val_workers > 0, prefetch_factor=args.prefetch_factor if val_workers > 0 else None,
             batch_size=round(args.batch_size*1.5), sampler=EvalDistributedSampler(dataset_val, num_replicas=dist.get_world_size(), rank=dist.get_rank()),
             shuffle=False, drop_last=False,
         )
         del dataset_val
         
         ld_train = DataLoader(
-            dataset=dataset_train, num_workers=args.workers, pin_memory=True,
+            dataset=dataset_train, num_workers=eff_workers, pin_memory=False, collate_fn=pin_memory_collate,
+            persistent_workers=eff_workers > 0,    # never shut down: the infinite batch_sampler has no epoch end anyway
+            prefetch_factor=args.prefetch_factor if eff_workers > 0 else None,
             generator=args.get_different_generator_for_each_rank(), # worker_init_fn=worker_init_fn,
             batch_sampler=DistInfiniteBatchSampler(
                 dataset_len=len(dataset_train), glb_batch_size=args.glb_batch_size, same_seed_for_all_ranks=args.same_seed_for_all_ranks,
@@ -64,10 +73,10 @@ def build_everything(args: arg_util.Args):
         [print(line) for line in auto_resume_info]
         print(f'[dataloader multi processing] ...', end='', flush=True)
         stt = time.time()
-        iters_train = len(ld_train)
-        ld_train = iter(ld_train)
+        iters_train = len(ld_train)     # length comes from the batch_sampler; doesn't start workers
+        ld_train = misc.LazyDataLoaderIter(ld_train)    # worker spawn overlaps model build / VAE download
         # noinspection PyArgumentList
-        print(f'     [dataloader multi processing](*) finished! ({time.time()-stt:.2f}s)', flush=True, clean=True)
+        print(f'     [dataloader multi processing](*) backgrounded! ({time.time()-stt:.2f}s)', flush=True, clean=True)
         print(f'[dataloader] gbs={args.glb_batch_size}, lbs={args.batch_size}, iters_train={iters_train}, types(tr, va)={types}')
     
     else:
@@ -93,13 +102,31 @@ def build_everything(args: arg_util.Args):
     vae_ckpt = 'vae_ch160v4096z32.pth'
     if dist.is_local_master():
         if not os.path.exists(vae_ckpt):
-            os.system(f'wget https://huggingface.co/FoundationVision/var/resolve/main/{vae_ckpt}')
+            from huggingface_hub import hf_hub_download
+            # streams in-process with retry + resume; no wget subprocess to fork, and a killed
+            # download doesn't leave a partial file where the exists() check would trust it
+            hf_hub_download(repo_id='FoundationVision/var', filename=vae_ckpt, local_dir=os.path.dirname(os.path.abspath(vae_ckpt)))
     dist.barrier()
-    vae_local.load_state_dict(torch.load(vae_ckpt, map_location='cpu'), strict=True)
+    # mmap: tensors stay page-cache-backed instead of being read into Python-owned memory;
+    # weights_only skips pickle object deserialization. load_state_dict then copies each
+    # tensor straight from the mapping into the (GPU-resident) params, one copy total
+    if dist.is_master() or not dist.initialized():
+        vae_local.load_state_dict(torch.load(vae_ckpt, map_location='cpu', mmap=True, weights_only=True), strict=True)
+    if dist.initialized():
+        # one disk read + NCCL broadcast instead of world_size reads hammering the shared fs;
+        # the state_dict tensors alias the live (GPU) params, so broadcasting in place suffices
+        for t in vae_local.state_dict().values():
+            dist.broadcast(t, src_rank=0)
+    vae_local = vae_local.to(memory_format=torch.channels_last)  # NHWC conv kernels on tensor cores; no accuracy change
+
     
     vae_local: VQVAE = args.compile_model(vae_local, args.vfast)
     var_wo_ddp: VAR = args.compile_model(var_wo_ddp, args.tfast)
-    var: DDP = (DDP if dist.initialized() else NullDDP)(var_wo_ddp, device_ids=[dist.get_local_rank()], find_unused_parameters=False, broadcast_buffers=False)
+    if dist.initialized():
+        var: DDP = DDP(var_wo_ddp, device_ids=[dist.get_local_rank()], find_unused_parameters=False, broadcast_buffers=False)
+    else:
+        var = var_wo_ddp    # single-GPU: a DDP-shaped wrapper would only add a Python frame per forward
+        var.require_backward_grad_sync = True   # plain attribute here; train_step toggles it freely
     
     print(f'[INIT] VAR model = {var_wo_ddp}\n\n')
     count_p = lambda m: f'{sum(p.numel() for p in m.parameters())/1e6:.2f}'
@@ -114,16 +141,21 @@ def build_everything(args: arg_util.Args):
         'ada_gss', 'moe_bias',
         'scale_mul',
     })
+    for p in paras:
+        p.data = p.data.contiguous()    # fused/foreach multi-tensor kernels silently skip non-contiguous params
+    from utils.amp_sc import pick_adamw_impl
+    adamw_kw = pick_adamw_impl(paras, args.fp16) if args.afuse else {}
+    print(f'[INIT] AdamW impl kwargs = {adamw_kw}')
     opt_clz = {
-        'adam':  partial(torch.optim.AdamW, betas=(0.9, 0.95), fused=args.afuse),
-        'adamw': partial(torch.optim.AdamW, betas=(0.9, 0.95), fused=args.afuse),
+        'adam':  partial(torch.optim.AdamW, betas=(0.9, 0.95), **adamw_kw),
+        'adamw': partial(torch.optim.AdamW, betas=(0.9, 0.95), **adamw_kw),
     }[args.opt.lower().strip()]
     opt_kw = dict(lr=args.tlr, weight_decay=0)
     print(f'[INIT] optim={opt_clz}, opt_kw={opt_kw}\n')
     
     var_optim = AmpOptimizer(
         mixed_precision=args.fp16, optimizer=opt_clz(params=para_groups, **opt_kw), names=names, paras=paras,
-        grad_clip=args.tclip, n_gradient_accumulation=args.ac
+        grad_clip=args.tclip, n_gradient_accumulation=args.ac, fuse_accumulation=args.afuse_accu,
     )
     del names, paras, para_groups
     
@@ -219,15 +251,13 @@ def main_training():
                 local_out_ckpt = os.path.join(args.local_out_dir_path, 'ar-ckpt-last.pth')
                 local_out_ckpt_best = os.path.join(args.local_out_dir_path, 'ar-ckpt-best.pth')
                 print(f'[saving ckpt] ...', end='', flush=True)
-                torch.save({
+                misc.save_ckpt_async({
                     'epoch':    ep+1,
                     'iter':     0,
                     'trainer':  trainer.state_dict(),
                     'args':     args.state_dict(),
-                }, local_out_ckpt)
-                if best_updated:
-                    shutil.copy(local_out_ckpt, local_out_ckpt_best)
-                print(f'     [saving ckpt](*) finished!  @ {local_out_ckpt}', flush=True, clean=True)
+                }, local_out_ckpt, best_dst=local_out_ckpt_best if best_updated else None)
+                print(f'     [saving ckpt](*) serialized to shm; disk write continues in background  @ {local_out_ckpt}', flush=True, clean=True)
             dist.barrier()
         
         print(    f'     [ep{ep}]  (training )  Lm: {best_L_mean:.3f} ({L_mean:.3f}), Lt: {best_L_tail:.3f} ({L_tail:.3f}),  Acc m&t: {best_acc_mean:.2f} {best_acc_tail:.2f},  Remain: {remain_time},  Finish: {finish_time}', flush=True)
@@ -253,7 +283,7 @@ def main_training():
 def train_one_ep(ep: int, is_first_ep: bool, start_it: int, args: arg_util.Args, tb_lg: misc.TensorboardLogger, ld_or_itrt, iters_train: int, trainer):
     # import heavy packages after Dataloader object creation
     from trainer import VARTrainer
-    from utils.lr_control import lr_wd_annealing
+    from utils.lr_control import lr_wd_annealing_table, set_lr_wd
     trainer: VARTrainer
     
     step_cnt = 0
@@ -268,19 +298,33 @@ def train_one_ep(ep: int, is_first_ep: bool, start_it: int, args: arg_util.Args,
         warnings.filterwarnings('ignore', category=DeprecationWarning)
         warnings.filterwarnings('ignore', category=UserWarning)
     g_it, max_it = ep * iters_train, args.ep * iters_train
-    
+    wp_it = args.wp * iters_train
+    # the whole lr/wd schedule is precomputed once per epoch; per-iter cost is one array index
+    lr_sched, wd_sched = lr_wd_annealing_table(args.sche, args.tlr, args.twd, args.twde, wp_it, max_it, wp0=args.wp0, wpe=args.wpe)
+    # dedicated H2D copy stream: the CPU runs ahead of the GPU, so issuing the pinned-memory
+    # copy of batch N on its own stream lets it overlap the tail of batch N-1's compute
+    copy_stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+
     for it, (inp, label) in me.log_every(start_it, iters_train, ld_or_itrt, 30 if iters_train > 8000 else 5, header):
         g_it = ep * iters_train + it
         if it < start_it: continue
         if is_first_ep and it == start_it: warnings.resetwarnings()
-        
-        inp = inp.to(args.device, non_blocking=True)
-        label = label.to(args.device, non_blocking=True)
-        
+
+        if copy_stream is not None:
+            with torch.cuda.stream(copy_stream):
+                inp = inp.to(args.device, non_blocking=True)
+                label = label.to(args.device, non_blocking=True)
+            torch.cuda.current_stream().wait_stream(copy_stream)
+            inp.record_stream(torch.cuda.current_stream())
+            label.record_stream(torch.cuda.current_stream())
+        else:
+            inp = inp.to(args.device, non_blocking=True)
+            label = label.to(args.device, non_blocking=True)
+        inp = normalize_uint8_into_pm1(inp.contiguous(memory_format=torch.channels_last))  # dataloader ships uint8; cast + scale on the GPU, NHWC to match the VAE
+
         args.cur_it = f'{it+1}/{iters_train}'
         
-        wp_it = args.wp * iters_train
-        min_tlr, max_tlr, min_twd, max_twd = lr_wd_annealing(args.sche, trainer.var_opt.optimizer, args.tlr, args.twd, args.twde, g_it, wp_it, max_it, wp0=args.wp0, wpe=args.wpe)
+        min_tlr, max_tlr, min_twd, max_twd = set_lr_wd(trainer.var_opt.optimizer, lr_sched[g_it], wd_sched[g_it])
         args.cur_lr, args.cur_wd = max_tlr, max_twd
         
         if args.pg: # default: args.pg == 0.0, means no progressive training, won't get into this
@@ -303,28 +347,22 @@ def train_one_ep(ep: int, is_first_ep: bool, start_it: int, args: arg_util.Args,
         
         me.update(tlr=max_tlr)
         tb_lg.set_step(step=g_it)
-        tb_lg.update(head='AR_opt_lr/lr_min', sche_tlr=min_tlr)
-        tb_lg.update(head='AR_opt_lr/lr_max', sche_tlr=max_tlr)
-        tb_lg.update(head='AR_opt_wd/wd_max', sche_twd=max_twd)
-        tb_lg.update(head='AR_opt_wd/wd_min', sche_twd=min_twd)
-        tb_lg.update(head='AR_opt_grad/fp16', scale_log2=scale_log2)
-        
+        opt_scalars = {
+            'AR_opt_lr/lr_min/sche_tlr': min_tlr,
+            'AR_opt_lr/lr_max/sche_tlr': max_tlr,
+            'AR_opt_wd/wd_max/sche_twd': max_twd,
+            'AR_opt_wd/wd_min/sche_twd': min_twd,
+            'AR_opt_grad/fp16/scale_log2': scale_log2,
+        }
         if args.tclip > 0:
-            tb_lg.update(head='AR_opt_grad/grad', grad_norm=grad_norm)
-            tb_lg.update(head='AR_opt_grad/grad', grad_clip=args.tclip)
+            opt_scalars['AR_opt_grad/grad/grad_norm'] = grad_norm
+            opt_scalars['AR_opt_grad/grad/grad_clip'] = args.tclip
+        tb_lg.update_many(opt_scalars)
     
     me.synchronize_between_processes()
-    return {k: meter.global_avg for k, meter in me.meters.items()}, me.iter_time.time_preds(max_it - (g_it + 1) + (args.ep - ep) * 15)  # +15: other cost
-
-
-class NullDDP(torch.nn.Module):
-    def __init__(self, module, *args, **kwargs):
-        super(NullDDP, self).__init__()
-        self.module = module
-        self.require_backward_grad_sync = False
-    
-    def forward(self, *args, **kwargs):
-        return self.module(*args, **kwargs)
+    # only the master's ETA is ever printed; skip the strftime/timedelta work elsewhere
+    time_pred = me.iter_time.time_preds(max_it - (g_it + 1) + (args.ep - ep) * 15) if dist.is_master() else (0., '-', '-')  # +15: other cost
+    return {k: meter.global_avg for k, meter in me.meters.items()}, time_pred
 
 
 if __name__ == '__main__':
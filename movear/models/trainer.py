@@ -9,6 +9,7 @@ from torch.utils.data import DataLoader
 import dist
 from models import VAR, VQVAE, VectorQuantizer2
 from utils.amp_sc import AmpOptimizer
+from utils.data import normalize_uint8_into_pm1
 from utils.misc import MetricLogger, TensorboardLogger
 
 Ten = torch.Tensor
@@ -60,7 +61,7 @@ class VARTrainer(object):
         self.var_wo_ddp.eval()
         for inp_B3HW, label_B in ld_val:
             B, V = label_B.shape[0], self.vae_local.vocab_size
-            inp_B3HW = inp_B3HW.to(dist.get_device(), non_blocking=True)
+            inp_B3HW = normalize_uint8_into_pm1(inp_B3HW.to(dist.get_device(), non_blocking=True).contiguous(memory_format=torch.channels_last))
             label_B = label_B.to(dist.get_device(), non_blocking=True)
             
             gt_idx_Bl: List[ITen] = self.vae_local.img_to_idxBl(inp_B3HW)
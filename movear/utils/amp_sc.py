@@ -1,9 +1,32 @@
+import inspect
 import math
 from typing import List, Optional, Tuple, Union
 
 import torch
 
 
+def pick_adamw_impl(paras: List[torch.nn.Parameter], mixed_precision: int) -> dict:
+    """Choose between the fused and foreach AdamW kernels.
+
+    fused=True is the fastest when it applies, but several PyTorch versions (2.0.x~2.2.x)
+    regress below foreach under bf16 autocast with many small params, so fused is only
+    picked for CUDA params, non-bf16 training (mixed_precision != 2) and PyTorch >= 2.3;
+    everything else falls back to foreach.
+    """
+    sig = inspect.signature(torch.optim.AdamW).parameters
+    try:
+        torch_ver = tuple(int(v) for v in torch.__version__.split('+')[0].split('.')[:2])
+    except ValueError:
+        torch_ver = (0, 0)
+    if (
+        'fused' in sig and torch_ver >= (2, 3)
+        and torch.cuda.is_available() and all(p.is_cuda for p in paras)
+        and mixed_precision != 2    # bf16: fused AdamW is known to be slower than foreach here
+    ):
+        return {'fused': True}
+    return {'foreach': True} if 'foreach' in sig else {}
+
+
 class NullCtx:
     def __enter__(self):
         pass
@@ -17,7 +40,7 @@ class AmpOptimizer:
         self,
         mixed_precision: int,
         optimizer: torch.optim.Optimizer, names: List[str], paras: List[torch.nn.Parameter],
-        grad_clip: float, n_gradient_accumulation: int = 1,
+        grad_clip: float, n_gradient_accumulation: int = 1, fuse_accumulation: bool = False,
     ):
         self.enable_amp = mixed_precision > 0
         self.using_fp16_rather_bf16 = mixed_precision == 1
@@ -35,7 +58,58 @@ class AmpOptimizer:
         self.late_clipping = self.grad_clip > 0 and hasattr(optimizer, 'global_grad_norm')
         
         self.r_accu = 1 / n_gradient_accumulation   # r_accu == 1.0 / n_gradient_accumulation
-    
+        # AdamA-style accumulation: fold each micro-batch's gradient into the AdamW moments
+        # right after backward and free p.grad, instead of holding the summed gradient for the
+        # whole accumulation window (saves 4B per param when n_gradient_accumulation > 1).
+        # fp16 needs the scaler to own p.grad until unscale_, so it silently falls back there.
+        self.fuse_accumulation = fuse_accumulation and n_gradient_accumulation > 1 and self.scaler is None
+        self.micro_step = 0
+
+    @torch.no_grad()
+    def _accumulate_grads_into_moments(self) -> Optional[torch.Tensor]:
+        # per-micro-batch moment update; the first micro-batch of each window applies the betas
+        # decay once, so after `ac` folds: m = beta1*m + (1-beta1)*sum(g_i), same for v
+        orig_norm = None
+        if self.early_clipping:     # the summed grad no longer exists, so clip each micro-batch
+            orig_norm = torch.nn.utils.clip_grad_norm_(self.paras, self.grad_clip)
+        for group in self.optimizer.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                state = self.optimizer.state[p]
+                if 'exp_avg' not in state:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p)
+                    state['exp_avg_sq'] = torch.zeros_like(p)
+                if self.micro_step == 0:
+                    state['exp_avg'].mul_(beta1)
+                    state['exp_avg_sq'].mul_(beta2)
+                state['exp_avg'].add_(p.grad, alpha=1-beta1)
+                state['exp_avg_sq'].addcmul_(p.grad, p.grad, value=1-beta2)
+                p.grad = None   # the whole point: drop the gradient buffer right away
+        self.micro_step += 1
+        return orig_norm
+
+    @torch.no_grad()
+    def _fused_accum_step(self):
+        # bias correction + param update only; the gradient work already happened micro-batch-wise
+        for group in self.optimizer.param_groups:
+            beta1, beta2 = group['betas']
+            lr, wd, eps = group['lr'], group['weight_decay'], group.get('eps', 1e-8)
+            for p in group['params']:
+                state = self.optimizer.state[p]
+                if 'exp_avg' not in state:
+                    continue
+                state['step'] += 1
+                bc1 = 1 - beta1 ** state['step']
+                bc2 = 1 - beta2 ** state['step']
+                if wd != 0:
+                    p.mul_(1 - lr * wd)     # decoupled weight decay, as in AdamW
+                denom = state['exp_avg_sq'].div(bc2).sqrt_().add_(eps)
+                p.addcdiv_(state['exp_avg'], denom, value=-lr / bc1)
+        self.micro_step = 0
+
     def backward_clip_step(
         self, stepping: bool, loss: torch.Tensor,
     ) -> Tuple[Optional[Union[torch.Tensor, float]], Optional[float]]:
@@ -46,7 +120,13 @@ class AmpOptimizer:
             self.scaler.scale(loss).backward(retain_graph=False, create_graph=False)
         else:
             loss.backward(retain_graph=False, create_graph=False)
-        
+
+        if self.fuse_accumulation:  # scaler is None here, see __init__
+            orig_norm = self._accumulate_grads_into_moments()
+            if stepping:
+                self._fused_accum_step()
+            return orig_norm, scaler_sc
+
         if stepping:
             if self.scaler is not None: self.scaler.unscale_(self.optimizer)
             if self.early_clipping:
@@ -58,6 +58,7 @@ class Args(Tap):
     
     opt: str = 'adamw'      # lion: https://cloud.tencent.com/developer/article/2336657?areaId=106001 lr=5e-5 (0.25x) wd=0.8 (8x); Lion needs a large bs to work
     afuse: bool = True      # fused adamw
+    afuse_accu: bool = False    # AdamA-style: fold grads into adamw moments per micro-batch, freeing the grad buffer (only effective when ac > 1 and not fp16)
     
     # other hps
     saln: bool = False      # whether to use shared adaln
@@ -74,6 +75,8 @@ class Args(Tap):
     mid_reso: float = 1.125     # aug: first resize to mid_reso = 1.125 * data_load_reso, then crop to data_load_reso
     hflip: bool = False         # augmentation: horizontal flip
     workers: int = 0        # num workers; 0: auto, -1: don't use multiprocessing in DataLoader
+    prefetch_factor: int = 4    # batches prefetched per worker; raise this when the GPU is starving on input
+    auto_workers: bool = False  # cap num workers to cpu_count // world_size to avoid oversubscription on crowded nodes
     
     # progressive training
     pg: float = 0.0         # >0 for use progressive training during [0%, this] of training
@@ -148,11 +151,18 @@ class Args(Tap):
     def compile_model(self, m, fast):
         if fast == 0 or self.local_debug:
             return m
-        return torch.compile(m, mode={
+        mode = {
             1: 'reduce-overhead',
             2: 'max-autotune',
             3: 'default',
-        }[fast]) if hasattr(torch, 'compile') else m
+        }[fast]
+        if mode == 'default':
+            return torch.compile(m) if hasattr(torch, 'compile') else m
+        # reduce-overhead/max-autotune capture CUDA graphs, which kills per-kernel launch
+        # overhead on the many-tiny-kernels MoE step; the per-step shape is fixed (the batch
+        # sampler pads to a constant bs), so pin dynamic=False to keep the graphs reusable.
+        # fullgraph stays off: graph breaks fall back to eager instead of erroring out
+        return torch.compile(m, mode=mode, dynamic=False, fullgraph=False) if hasattr(torch, 'compile') else m
     
     def state_dict(self, key_ordered=True) -> Union[OrderedDict, dict]:
         d = (OrderedDict if key_ordered else dict)()
@@ -1,7 +1,9 @@
 import math
+import re
 from pprint import pformat
 from typing import Tuple, List, Dict, Union
 
+import numpy as np
 import torch.nn
 
 import movear.models.dist as dist
@@ -46,7 +48,45 @@ def lr_wd_annealing(sche_type: str, optimizer, peak_lr, wd, wd_end, cur_it, wp_i
     cur_lr *= peak_lr
     pasd = cur_it / (max_it-1)
     cur_wd = wd_end + (wd - wd_end) * (0.5 + 0.5 * math.cos(math.pi * pasd))
-    
+    return set_lr_wd(optimizer, cur_lr, cur_wd)
+
+
+def lr_wd_annealing_table(sche_type: str, peak_lr, wd, wd_end, wp_it, max_it, wp0=0.005, wpe=0.001) -> Tuple[np.ndarray, np.ndarray]:
+    """Precompute the whole lr/wd schedule of lr_wd_annealing as two arrays of length max_it,
+    so the train loop pays one array index per iteration instead of math + branching."""
+    wp_it = round(wp_it)
+    it = np.arange(max_it, dtype=np.float64)
+    pasd = (it - wp_it) / max(max_it-1 - wp_it, 1)   # [0, 1]
+    rest = 1 - pasd     # [1, 0]
+    if sche_type == 'cos':
+        cur_lr = wpe + (1-wpe) * (0.5 + 0.5 * np.cos(np.pi * pasd))
+    elif sche_type == 'lin':
+        T = 0.15; max_rest = 1-T
+        cur_lr = np.where(pasd < T, 1, wpe + (1-wpe) * rest / max_rest)  # 1 to wpe
+    elif sche_type == 'lin0':
+        T = 0.05; max_rest = 1-T
+        cur_lr = np.where(pasd < T, 1, wpe + (1-wpe) * rest / max_rest)
+    elif sche_type == 'lin00':
+        cur_lr = wpe + (1-wpe) * rest
+    elif sche_type.startswith('lin'):
+        T = float(sche_type[3:]); max_rest = 1-T
+        wpe_mid = wpe + (1-wpe) * max_rest
+        wpe_mid = (1 + wpe_mid) / 2
+        cur_lr = np.where(pasd < T, 1 + (wpe_mid-1) * pasd / T, wpe + (wpe_mid-wpe) * rest / max_rest)
+    elif sche_type == 'exp':
+        T = 0.15; max_rest = 1-T
+        expo = (pasd-T) / max_rest * math.log(wpe)
+        cur_lr = np.where(pasd < T, 1, np.exp(expo))
+    else:
+        raise NotImplementedError(f'unknown sche_type {sche_type}')
+
+    warmup = wp0 + (1-wp0) * it / max(wp_it, 1)
+    lr_sched = np.where(it < wp_it, warmup, cur_lr) * peak_lr
+    wd_sched = wd_end + (wd - wd_end) * (0.5 + 0.5 * np.cos(np.pi * it / max(max_it-1, 1)))
+    return lr_sched, wd_sched
+
+
+def set_lr_wd(optimizer, cur_lr: float, cur_wd: float) -> Tuple[float, float, float, float]:
     inf = 1e6
     min_lr, max_lr = inf, -1
     min_wd, max_wd = inf, -1
@@ -54,7 +94,7 @@ def lr_wd_annealing(sche_type: str, optimizer, peak_lr, wd, wd_end, cur_it, wp_i
         param_group['lr'] = cur_lr * param_group.get('lr_sc', 1)    # 'lr_sc' could be assigned
         max_lr = max(max_lr, param_group['lr'])
         min_lr = min(min_lr, param_group['lr'])
-        
+
         param_group['weight_decay'] = cur_wd * param_group.get('wd_sc', 1)
         max_wd = max(max_wd, param_group['weight_decay'])
         if param_group['weight_decay'] > 0:
@@ -72,6 +112,9 @@ def filter_params(model, nowd_keys=()) -> Tuple[
     names, paras = [], []
     names_no_grad = []
     count, numel = 0, 0
+    # one compiled alternation instead of len(nowd_keys) Python substring scans per param;
+    # matters for MoE models where expert copies multiply the parameter names
+    nowd_pat = re.compile('|'.join(map(re.escape, sorted(nowd_keys)))) if nowd_keys else None
     for name, para in model.named_parameters():
         name = name.replace('_fsdp_wrapped_module.', '')
         if not para.requires_grad:
@@ -82,7 +125,7 @@ def filter_params(model, nowd_keys=()) -> Tuple[
         names.append(name)
         paras.append(para)
         
-        if para.ndim == 1 or name.endswith('bias') or any(k in name for k in nowd_keys):
+        if para.ndim == 1 or name.endswith('bias') or (nowd_pat is not None and nowd_pat.search(name)):
             cur_wd_sc, group_name = 0., 'ND'
         else:
             cur_wd_sc, group_name = 1., 'D'
@@ -2,10 +2,13 @@ import datetime
 import functools
 import glob
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
-from collections import defaultdict, deque
+from collections import defaultdict
 from typing import Iterator, List, Tuple
 
 import numpy as np
@@ -124,6 +127,39 @@ class DistLogger(object):
         return getattr(self._lg, attr) if self._verbose else DistLogger.do_nothing
 
 
+class LazyDataLoaderIter(object):
+    """Materializes iter(DataLoader) — which spawns the worker processes and can take tens of
+    seconds with many workers — in a background thread, so model build and VAE download overlap
+    it. Quacks like an Iterator, which is what MetricLogger.log_every expects for the infinite
+    train loader; the first next() joins the thread if the workers aren't up yet."""
+    def __init__(self, loader):
+        self._it = None
+        self._thread = threading.Thread(target=self._materialize, args=(loader,), daemon=True)
+        self._thread.start()
+
+    def _materialize(self, loader):
+        self._it = iter(loader)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return next(self._it)
+
+
+class NullBar(object):
+    """No-op stand-in for tqdm on non-master ranks: the train loop drives a single
+    unconditional `pbar` without per-iter rank checks or duplicate terminal IO."""
+    def update(self, n=1): pass
+    def set_description(self, *args, **kwargs): pass
+    def set_postfix(self, *args, **kwargs): pass
+    def set_postfix_str(self, *args, **kwargs): pass
+    def close(self): pass
+
+
 class TensorboardLogger(object):
     def __init__(self, log_dir, filename_suffix):
         try: import tensorflow_io as tfio
@@ -152,6 +188,22 @@ class TensorboardLogger(object):
                 if hasattr(v, 'item'): v = v.item()
                 self.writer.add_scalar(f'{head}/{k}', v, step)
     
+    def update_many(self, scalars, step=None):
+        # batched version of update(): `scalars` maps a full 'head/key' tag to its value, so the
+        # per-iter call stack collapses to one method dispatch that returns immediately on the
+        # iters the 1-in-500 sampling would skip anyway
+        if step is None:  # iter wise
+            it = self.step
+            if it != 0 and (it + 1) % 500 != 0:
+                return
+        else:  # epoch wise
+            it = step
+        for tag, v in scalars.items():
+            if v is None:
+                continue
+            if hasattr(v, 'item'): v = v.item()
+            self.writer.add_scalar(tag, v, it)
+
     def log_tensor_as_distri(self, tag, tensor1d, step=None):
         if step is None:  # iter wise
             step = self.step
@@ -188,13 +240,20 @@ class SmoothedValue(object):
     def __init__(self, window_size=30, fmt=None):
         if fmt is None:
             fmt = "{median:.4f} ({global_avg:.4f})"
-        self.deque = deque(maxlen=window_size)
+        # flat float32 ring buffer instead of a deque of Python floats: update() is two
+        # array stores, and the window stats run as single numpy calls over C memory
+        self._buf = np.zeros(window_size, dtype=np.float32)
+        self._size = 0
+        self._idx = 0
+        self._last = 0.
         self.total = 0.0
         self.count = 0
         self.fmt = fmt
     
     def update(self, value, n=1):
-        self.deque.append(value)
+        self._buf[self._idx] = self._last = value
+        self._idx = (self._idx + 1) % len(self._buf)
+        if self._size < len(self._buf): self._size += 1
         self.count += n
         self.total += value * n
     
@@ -209,13 +268,19 @@ class SmoothedValue(object):
         self.count = int(t[0])
         self.total = t[1]
     
+    @property
+    def deque(self):    # the window's values, kept for compatibility with the old deque-based impl
+        return self._buf[:self._size]
+    
     @property
     def median(self):
-        return np.median(self.deque) if len(self.deque) else 0
+        if self._size == 0: return 0
+        k = self._size >> 1
+        return float(np.partition(self._buf[:self._size], k)[k])    # O(N) selection, no full sort
     
     @property
     def avg(self):
-        return sum(self.deque) / (len(self.deque) or 1)
+        return float(self._buf[:self._size].mean()) if self._size else 0.
     
     @property
     def global_avg(self):
@@ -223,11 +288,11 @@ class SmoothedValue(object):
     
     @property
     def max(self):
-        return max(self.deque)
+        return float(self._buf[:self._size].max())
     
     @property
     def value(self):
-        return self.deque[-1] if len(self.deque) else 0
+        return self._last if self._size else 0
     
     def time_preds(self, counts) -> Tuple[float, str, str]:
         remain_secs = counts * self.median
@@ -276,8 +341,18 @@ class MetricLogger(object):
         return self.delimiter.join(loss_str)
     
     def synchronize_between_processes(self):
-        for meter in self.meters.values():
-            meter.synchronize_between_processes()
+        if not tdist.is_initialized() or not self.meters:
+            return
+        # one stacked [n_meters, 2] all_reduce instead of a collective per meter: the payloads
+        # are tiny, so NCCL launch overhead dominates and amortizing it is the whole win
+        meters = list(self.meters.values())
+        t = torch.tensor([[m.count, m.total] for m in meters], dtype=torch.float64, device='cuda')
+        tdist.barrier()
+        tdist.all_reduce(t)
+        t = t.tolist()
+        for m, (count, total) in zip(meters, t):
+            m.count = int(count)
+            m.total = total
     
     def add_meter(self, name, meter):
         self.meters[name] = meter
@@ -337,6 +412,27 @@ class MetricLogger(object):
             header, total_time_str, total_time / max_iters), flush=True)
 
 
+def save_ckpt_async(ckpt: dict, dst: str, best_dst: str = None) -> threading.Thread:
+    """Serialize the checkpoint into /dev/shm (RAM-backed, so torch.save returns at memcpy
+    speed and the other ranks leave their barrier quickly), then commit it to `dst` on disk
+    in a background thread; the final os.replace keeps `dst` atomic for auto_resume."""
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else os.path.dirname(dst)
+    fd, tmp = tempfile.mkstemp(dir=shm_dir, prefix='ar-ckpt-', suffix='.pth')
+    os.close(fd)
+    torch.save(ckpt, tmp)
+
+    def _commit():
+        part = dst + '.tmp'
+        shutil.move(tmp, part)
+        os.replace(part, dst)
+        if best_dst is not None:
+            shutil.copy(dst, best_dst)
+
+    t = threading.Thread(target=_commit, daemon=False)   # non-daemon: the write survives train exit
+    t.start()
+    return t
+
+
 def glob_with_latest_modified_first(pattern, recursive=False):
     return sorted(glob.glob(pattern, recursive=recursive), key=os.path.getmtime, reverse=True)
 